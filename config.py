@@ -0,0 +1,97 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+
+import ctranslate2
+from dotenv import load_dotenv
+
+# ----------------------------
+# 환경변수 단일 소스 설정
+# ----------------------------
+@dataclass(frozen=True)
+class Config:
+    db: dict
+
+    aws_access_key_id: str
+    aws_secret_access_key: str
+    aws_region: str
+
+    s3_bucket: str
+    # 버킷 내 오디오 키 구성 (배포별로 prefix가 다름)
+    s3_key_template: str
+    s3_max_concurrency: int
+
+    model_dir: str
+    # 크기 이름("large-v3") 또는 CT2 변환 모델의 HF repo id(예: 사전 양자화된 int8 가중치)
+    model_size: str
+    device: str
+    compute_type: str
+    batch_size: int
+    language: str
+    num_workers: int
+    macro_chunk_seconds: int
+    cpu_threads: int
+    cpu_affinity: str
+    chunk_length: int
+    vad_onset: float
+    vad_offset: float
+
+    job_loop_delay: int
+    job_batch_size: int
+    notify_channel: str
+    prefetch_depth: int
+
+    audio_spool_dir: str
+    pcm_cache_dir: str
+    pcm_cache_max_bytes: int
+
+
+@lru_cache(maxsize=1)
+def get_config():
+    load_dotenv()
+
+    # 미설정 시 CUDA 사용 가능 여부로 자동 선택
+    device = os.getenv("WHISPER_DEVICE") or ("cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu")
+    # CPU는 "int8", GPU는 "int8_float16" 또는 "float16" (미설정 시 디바이스에 맞게 자동 선택)
+    compute_type = os.getenv("WHISPER_COMPUTE_TYPE") or ("float16" if device == "cuda" else "int8")
+
+    return Config(
+        db={
+            "dbname": os.getenv("DB_NAME"),
+            "user": os.getenv("DB_USER"),
+            "password": os.getenv("DB_PASSWORD"),
+            "host": os.getenv("DB_HOST"),
+            "port": int(os.getenv("DB_PORT", "5432")),
+        },
+        aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+        aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+        aws_region=os.getenv("AWS_REGION"),
+        s3_bucket=os.getenv("S3_BUCKET"),
+        s3_key_template=os.getenv("S3_KEY_TEMPLATE", "meets/{rec_id}/audio.m4a"),
+        s3_max_concurrency=int(os.getenv("S3_MAX_CONCURRENCY", "16")),
+        model_dir=os.getenv("WHISPER_MODEL_DIR", "model"),
+        model_size=os.getenv("WHISPER_MODEL_SIZE"),
+        device=device,
+        compute_type=compute_type,
+        batch_size=int(os.getenv("WHISPER_BATCH_SIZE", "16" if device == "cuda" else "8")),
+        language=os.getenv("WHISPER_LANGUAGE", "ko"),
+        num_workers=int(os.getenv("WHISPER_NUM_WORKERS", "1")),
+        macro_chunk_seconds=int(os.getenv("MACRO_CHUNK_SECONDS", "300")),
+        # 0이면 CT2 기본값 사용; 한 호스트에 데몬 여러 개를 띄울 때 과다 구독 방지용
+        cpu_threads=int(os.getenv("CPU_THREADS", "0")),
+        # 예: "0,1,2,3" — 설정 시 프로세스를 해당 코어 집합에 고정
+        cpu_affinity=os.getenv("CPU_AFFINITY", ""),
+        chunk_length=int(os.getenv("WHISPER_CHUNK_LENGTH", "30")),
+        # Silero VAD 발화 시작/종료 확률 임계값 (회의 녹음의 긴 무음 구간을 디코더 앞에서 걸러낸다)
+        vad_onset=float(os.getenv("VAD_ONSET", "0.5")),
+        vad_offset=float(os.getenv("VAD_OFFSET", "0.35")),
+        job_loop_delay=int(os.getenv("JOB_LOOP_DELAY", "30")),
+        job_batch_size=int(os.getenv("JOB_BATCH_SIZE", "4")),
+        notify_channel=os.getenv("NOTIFY_CHANNEL", "meet_recording_ready"),
+        prefetch_depth=int(os.getenv("PREFETCH_DEPTH", "1")),
+        # 설정 시(예: /dev/shm) 스트리밍 대신 해당 경로에 스풀한 뒤 mmap으로 ffmpeg에 공급
+        audio_spool_dir=os.getenv("AUDIO_SPOOL_DIR", ""),
+        # 디코드된 PCM을 ETag 기준으로 캐시해 재시도 시 S3/ffmpeg를 건너뛴다 (빈 문자열로 비활성화)
+        pcm_cache_dir=os.getenv("PCM_CACHE_DIR", "/var/cache/jw-asr"),
+        pcm_cache_max_bytes=int(os.getenv("PCM_CACHE_MAX_BYTES", str(10 * 1024 ** 3))),
+    )
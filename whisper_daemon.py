@@ -1,67 +1,77 @@
 import os
 import time
-import tempfile
+import queue
+import select
+import subprocess
+import threading
 import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 import psycopg2
-import whisperx
+import psycopg2.pool
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 import boto3
-from dotenv import load_dotenv
+from faster_whisper import WhisperModel, BatchedInferencePipeline
+from boto3.s3.transfer import TransferConfig
+
+from config import get_config
 
 # ----------------------------
 # 초기화
 # ----------------------------
-load_dotenv()
-
-DB_CONFIG = {
-    "dbname": os.getenv("DB_NAME"),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD"),
-    "host": os.getenv("DB_HOST"),
-    "port": int(os.getenv("DB_PORT", "5432")),
-}
+CFG = get_config()
 
 AWS_SESSION = boto3.Session(
-    aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-    aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-    region_name=os.getenv("AWS_REGION")
+    aws_access_key_id=CFG.aws_access_key_id,
+    aws_secret_access_key=CFG.aws_secret_access_key,
+    region_name=CFG.aws_region
 )
 
 s3 = AWS_SESSION.client("s3")
 
-WHISPER_MODEL_DIR = "model"
-WHISPER_MODEL_SIZE = os.getenv("WHISPER_MODEL_SIZE")
-WHISPER_DEVICE = os.getenv("WHISPER_DEVICE")
-WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE")
-WHISPER_BATCH_SIZE = os.getenv("WHISPER_BATCH_SIZE", "1")
-WHISPER_LANGUAGE = os.getenv("WHISPER_LANGUAGE", "ko")
-
-S3_BUCKET = os.getenv("S3_BUCKET")
-
-JOB_LOOP_DELAY = os.getenv("JOB_LOOP_DELAY", "30")
-
 model = None
+_model_pid = None
+
+# ----------------------------
+# DB 커넥션 풀
+# ----------------------------
+DB_POOL = psycopg2.pool.ThreadedConnectionPool(1, 4, **CFG.db)
 
 # ----------------------------
 # 모델 초기화
 # ----------------------------
 def init_model():
-    global model
-    if model is None:
-        print("[INFO] Loading WhisperX model...")
-        model = whisperx.load_model(
-            WHISPER_MODEL_SIZE,
-            device=WHISPER_DEVICE,
-            compute_type=WHISPER_COMPUTE_TYPE,
-            download_root=WHISPER_MODEL_DIR,
-            vad_method="silero"
+    global model, _model_pid
+    # fork된 워커 프로세스는 부모의 CT2 핸들을 공유할 수 없으므로 pid별로 다시 로드
+    if model is None or _model_pid != os.getpid():
+        if not CFG.model_size:
+            raise RuntimeError("WHISPER_MODEL_SIZE must be set")
+        if CFG.cpu_affinity:
+            os.sched_setaffinity(0, {int(cpu) for cpu in CFG.cpu_affinity.split(",")})
+        if CFG.cpu_threads:
+            # 모델 로드 전에 지정해야 OpenMP/MKL 스레드 풀 크기에 반영된다
+            os.environ["OMP_NUM_THREADS"] = str(CFG.cpu_threads)
+            os.environ["MKL_NUM_THREADS"] = str(CFG.cpu_threads)
+        print(f"[INFO] Loading Whisper model... (device={CFG.device}, compute_type={CFG.compute_type})")
+        model = BatchedInferencePipeline(
+            model=WhisperModel(
+                CFG.model_size,
+                device=CFG.device,
+                compute_type=CFG.compute_type,
+                download_root=CFG.model_dir,
+                cpu_threads=CFG.cpu_threads,
+                num_workers=1,
+            )
         )
+        _model_pid = os.getpid()
         print("[INFO] Model loaded.")
 
 # ----------------------------
 # 작업 조회 및 상태 선점
 # ----------------------------
-def get_next_target():
-    with psycopg2.connect(**DB_CONFIG) as conn:
+def get_next_targets(limit=CFG.job_batch_size):
+    conn = DB_POOL.getconn()
+    try:
         conn.autocommit = False
         with conn.cursor() as cur:
             cur.execute("""
@@ -69,22 +79,38 @@ def get_next_target():
                 FROM ims.meet_recording
                 WHERE status = 2
                 FOR UPDATE SKIP LOCKED
-                LIMIT 1
-            """)
-            row = cur.fetchone()
-            if row:
-                rec_id = row[0]
-                cur.execute("UPDATE ims.meet_recording SET status = 10 WHERE id = %s", (rec_id,))
-                conn.commit()
-                return rec_id
+                LIMIT %s
+            """, (limit,))
+            rec_ids = [row[0] for row in cur.fetchall()]
+            if rec_ids:
+                cur.execute("UPDATE ims.meet_recording SET status = 10 WHERE id = ANY(%s)", (rec_ids,))
             conn.commit()
-    return None
+        return rec_ids
+    finally:
+        DB_POOL.putconn(conn)
+
+# ----------------------------
+# 작업 알림 대기 (LISTEN/NOTIFY)
+# ----------------------------
+def open_listen_conn():
+    conn = psycopg2.connect(**CFG.db)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {CFG.notify_channel}")
+    return conn
+
+def wait_for_notify(conn, timeout):
+    # NOTIFY 또는 timeout까지 블록; 깨어나면 쌓인 알림을 비운다
+    if select.select([conn], [], [], timeout)[0]:
+        conn.poll()
+        conn.notifies.clear()
 
 # ----------------------------
 # 작업 결과 갱신
 # ----------------------------
 def update_result(rec_id, status, webvtt=None, error=None):
-    with psycopg2.connect(**DB_CONFIG) as conn:
+    conn = DB_POOL.getconn()
+    try:
         with conn.cursor() as cur:
             cur.execute("""
                 UPDATE ims.meet_recording
@@ -93,68 +119,289 @@ def update_result(rec_id, status, webvtt=None, error=None):
                     stacktrace = %s
                 WHERE id = %s
             """, (status, webvtt, error, rec_id))
+        conn.commit()
+    finally:
+        DB_POOL.putconn(conn)
 
 # ----------------------------
 # 오디오 다운로드
 # ----------------------------
+S3_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=CFG.s3_max_concurrency,
+    use_threads=True,
+)
+
 def download_audio(rec_id, dest_path):
-    s3_key = f"meets/{rec_id}/audio.m4a"
-    s3.download_file(S3_BUCKET, s3_key, dest_path)
+    s3_key = CFG.s3_key_template.format(rec_id=rec_id)
+    s3.download_file(CFG.s3_bucket, s3_key, dest_path, Config=S3_TRANSFER_CONFIG)
+
+# ----------------------------
+# S3 스트리밍 디코드
+# ----------------------------
+SAMPLE_RATE = 16000
+
+def _fetch_range(s3_key, start, end, mv_slice):
+    stream = s3.get_object(Bucket=CFG.s3_bucket, Key=s3_key, Range=f"bytes={start}-{end}")["Body"]
+    n = 0
+    while chunk := stream.read(1 << 20):
+        mv_slice[n:n + len(chunk)] = chunk
+        n += len(chunk)
+
+def _download_object_parallel(s3_key, total):
+    # 전체 크기만큼 미리 할당한 bytearray를 범위 GET으로 병렬로 채운다 (중간 버퍼 이어붙이기 없음)
+    buf = bytearray(total)
+    mv = memoryview(buf)
+    part = 8 * 1024 * 1024
+    with ThreadPoolExecutor(max_workers=CFG.s3_max_concurrency) as pool:
+        futures = [
+            pool.submit(_fetch_range, s3_key, start, min(start + part, total) - 1, mv[start:start + part])
+            for start in range(0, total, part)
+        ]
+        for future in futures:
+            future.result()
+    return buf
+
+def _feed_ffmpeg_buffer(buf, stdin):
+    try:
+        view = memoryview(buf)
+        for offset in range(0, len(view), 1 << 20):
+            stdin.write(view[offset:offset + (1 << 20)])
+    except BrokenPipeError:
+        pass
+    finally:
+        stdin.close()
+
+def _decode_with_ffmpeg(feed, source):
+    proc = subprocess.Popen(
+        ["ffmpeg", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+    )
+    feeder = threading.Thread(target=feed, args=(source, proc.stdin))
+    feeder.start()
+    pcm = proc.stdout.read()
+    feeder.join()
+    if proc.wait() != 0:
+        raise RuntimeError("ffmpeg decode failed")
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+def _decode_file_with_ffmpeg(path):
+    # 파일 경로를 직접 넘기면 ffmpeg가 seek할 수 있어 moov atom이 끝에 있는 m4a도 디코드된다
+    # (tmpfs 스풀이면 읽기는 여전히 메모리에서 이뤄진다)
+    proc = subprocess.Popen(
+        ["ffmpeg", "-loglevel", "error", "-i", path,
+         "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        stdout=subprocess.PIPE,
+    )
+    pcm = proc.stdout.read()
+    if proc.wait() != 0:
+        raise RuntimeError("ffmpeg decode failed")
+    return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+def _evict_pcm_cache():
+    # 총량이 한도를 넘으면 mtime이 오래된 파일부터 삭제
+    # 캐시 디렉터리를 공유하는 다른 데몬이 먼저 지운 파일은 건너뛴다
+    entries = []
+    total = 0
+    for name in os.listdir(CFG.pcm_cache_dir):
+        path = os.path.join(CFG.pcm_cache_dir, name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+    entries.sort()
+    for _mtime, size, path in entries:
+        if total <= CFG.pcm_cache_max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+def load_audio_from_s3(rec_id):
+    s3_key = CFG.s3_key_template.format(rec_id=rec_id)
+    head = s3.head_object(Bucket=CFG.s3_bucket, Key=s3_key)
+
+    cache_path = None
+    if CFG.pcm_cache_dir:
+        etag = head["ETag"].strip('"')
+        cache_path = os.path.join(CFG.pcm_cache_dir, f"{etag}.f32")
+        if os.path.exists(cache_path):
+            try:
+                os.utime(cache_path)  # LRU 순서 갱신
+                return np.memmap(cache_path, dtype=np.float32, mode="r")
+            except OSError:
+                pass  # 다른 데몬의 eviction과 경합한 경우 일반 디코드로 진행
+
+    if CFG.audio_spool_dir:
+        spool_path = os.path.join(CFG.audio_spool_dir, f"{rec_id}.m4a")
+        try:
+            download_audio(rec_id, spool_path)
+            audio = _decode_file_with_ffmpeg(spool_path)
+        finally:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+    else:
+        buf = _download_object_parallel(s3_key, head["ContentLength"])
+        audio = _decode_with_ffmpeg(_feed_ffmpeg_buffer, buf)
+
+    if cache_path:
+        # 캐시는 최적화일 뿐이므로 디스크 부족 등으로 실패해도 작업은 계속 진행
+        try:
+            os.makedirs(CFG.pcm_cache_dir, exist_ok=True)
+            # 캐시 디렉터리를 공유하는 데몬끼리 같은 tmp 파일에 겹쳐 쓰지 않도록 pid를 붙인다
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            audio.tofile(tmp_path)
+            os.replace(tmp_path, cache_path)
+            _evict_pcm_cache()
+        except OSError as e:
+            print(f"[WARN] PCM cache write failed: {e}")
+    return audio
 
 # ----------------------------
 # WhisperX 결과를 VTT로 변환
 # ----------------------------
+def format_times(seconds):
+    # 초 단위 배열을 numpy 정수 연산으로 h/m/s/ms 분해 (세그먼트당 format_time 호출 제거)
+    # ms는 기존 format_time과 동일하게 (seconds % 1) * 1000을 내림해 1ms 차이도 없게 유지
+    secs = np.asarray(seconds, dtype=np.float64)
+    ms = ((secs % 1) * 1000).astype(np.int64)
+    h, rem = np.divmod(secs.astype(np.int64), 3600)
+    m, s = np.divmod(rem, 60)
+    return [f"{h_:02}:{m_:02}:{s_:02}.{ms_:03}" for h_, m_, s_, ms_ in zip(h, m, s, ms)]
+
+_CUE_TEMPLATE = "{}\n{} --> {}\n{}\n".format
+
 def convert_to_vtt(segments):
-    lines = ["WEBVTT\n"]
-    for i, seg in enumerate(segments):
-        start = seg["start"]
-        end = seg["end"]
-        text = seg["text"].strip().replace("\n", " ")
-        lines.append(f"{i+1}")
-        lines.append(f"{format_time(start)} --> {format_time(end)}")
-        lines.append(text + "\n")
-    return "\n".join(lines)
-
-def format_time(seconds):
-    ms = int((seconds % 1) * 1000)
-    s = int(seconds)
-    h, m, s = s // 3600, (s % 3600) // 60, s % 60
-    return f"{h:02}:{m:02}:{s:02}.{ms:03}"
+    if not segments:
+        return "WEBVTT\n"
+    starts = format_times([seg["start"] for seg in segments])
+    ends = format_times([seg["end"] for seg in segments])
+    texts = [seg["text"].strip().replace("\n", " ") for seg in segments]
+    body = "\n".join(map(_CUE_TEMPLATE, range(1, len(texts) + 1), starts, ends, texts))
+    return "WEBVTT\n\n" + body
 
 # ----------------------------
 # STT 처리
 # ----------------------------
-def process_recording(rec_id):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        audio_path = os.path.join(tmpdir, "audio.m4a")
-        download_audio(rec_id, audio_path)
+def find_split_points(audio, chunk_seconds=CFG.macro_chunk_seconds, window_seconds=10):
+    # chunk_seconds 배수 부근에서 롤링 RMS가 가장 낮은(조용한) 샘플 위치를 분할점으로 고른다
+    frame = SAMPLE_RATE // 10  # 100ms
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return []
+    rms = np.sqrt(np.mean(np.square(audio[:n_frames * frame]).reshape(n_frames, frame), axis=1))
+    half_window = window_seconds * 10
+    points = []
+    target = chunk_seconds * SAMPLE_RATE
+    while target < len(audio):
+        center = target // frame
+        lo = max(0, center - half_window)
+        hi = min(n_frames, center + half_window)
+        if lo >= hi:
+            break
+        quiet = lo + int(np.argmin(rms[lo:hi]))
+        points.append(quiet * frame)
+        target = quiet * frame + chunk_seconds * SAMPLE_RATE
+    return points
+
+def _transcribe_chunk(audio, offset_sec=0.0):
+    init_model()
+    raw_segments, _info = model.transcribe(
+        audio,
+        batch_size=CFG.batch_size,
+        language=CFG.language,
+        chunk_length=CFG.chunk_length,
+        vad_filter=True,
+        # faster-whisper는 onset/offset을 threshold/neg_threshold로 개명함
+        vad_parameters={"threshold": CFG.vad_onset, "neg_threshold": CFG.vad_offset},
+    )
+    return [{"start": seg.start + offset_sec, "end": seg.end + offset_sec, "text": seg.text}
+            for seg in raw_segments]
 
-        audio = whisperx.load_audio(audio_path)
-        result = model.transcribe(audio, batch_size=int(WHISPER_BATCH_SIZE), language=WHISPER_LANGUAGE)
-        segments = result["segments"]
+_chunk_pool = None
 
-        vtt = convert_to_vtt(segments)
-        return vtt
+def _get_chunk_pool():
+    # 워커가 작업마다 모델을 다시 로드하지 않도록 풀을 데몬 수명 동안 유지
+    global _chunk_pool
+    if _chunk_pool is None:
+        _chunk_pool = ProcessPoolExecutor(max_workers=CFG.num_workers, initializer=init_model)
+    return _chunk_pool
+
+def transcribe_audio(audio):
+    split_points = find_split_points(audio)
+    # fork된 자식에서는 CUDA를 재초기화할 수 없으므로 병렬 경로는 CPU에서만 사용
+    if CFG.num_workers <= 1 or CFG.device != "cpu" or not split_points:
+        return _transcribe_chunk(audio)
+
+    bounds = [0] + split_points + [len(audio)]
+    chunks = [(audio[a:b], a / SAMPLE_RATE) for a, b in zip(bounds, bounds[1:])]
+    segments = []
+    for chunk_segments in _get_chunk_pool().map(_transcribe_chunk, *zip(*chunks)):
+        segments.extend(chunk_segments)
+    return segments
 
 # ----------------------------
 # 데몬 루프
 # ----------------------------
+def format_error(e):
+    # 프레임 수 제한 + 4 KiB 절단으로 재귀적인 스택에서도 저장 비용을 제한
+    return "".join(traceback.TracebackException.from_exception(e, limit=5).format())[:4096]
+
+def prefetch_loop(audio_queue):
+    # N번 작업 전사 중에 N+1번 작업의 다운로드/디코드를 미리 수행
+    listen_conn = None
+    while True:
+        try:
+            if listen_conn is None or listen_conn.closed:
+                listen_conn = open_listen_conn()
+
+            rec_ids = get_next_targets()
+            if not rec_ids:
+                # 프로듀서의 NOTIFY로 즉시 깨어나고, JOB_LOOP_DELAY는 안전망 폴링 주기로 유지
+                wait_for_notify(listen_conn, CFG.job_loop_delay)
+                continue
+
+            for rec_id in rec_ids:
+                try:
+                    print(f"[INFO] Prefetching: {rec_id}")
+                    audio = load_audio_from_s3(rec_id)
+                except Exception as e:
+                    update_result(rec_id, -1, error=format_error(e))
+                    print(f"[ERROR] Failed {rec_id}: {e}")
+                    continue
+                audio_queue.put((rec_id, audio))
+        except Exception as e:
+            # 일시적인 DB 장애 등으로 스레드가 죽으면 데몬 전체가 조용히 멈추므로 재시도
+            print(f"[ERROR] Prefetch loop error, retrying in {CFG.job_loop_delay}s: {e}")
+            if listen_conn is not None:
+                try:
+                    listen_conn.close()
+                except Exception:
+                    pass
+                listen_conn = None
+            time.sleep(CFG.job_loop_delay)
+
 def daemon_loop():
     init_model()
-    while True:
-        rec_id = get_next_target()
-        if not rec_id:
-            time.sleep(int(JOB_LOOP_DELAY))
-            continue
+    audio_queue = queue.Queue(maxsize=CFG.prefetch_depth)
+    threading.Thread(target=prefetch_loop, args=(audio_queue,), daemon=True).start()
 
+    while True:
+        rec_id, audio = audio_queue.get()
         try:
             print(f"[INFO] Processing: {rec_id}")
-            vtt = process_recording(rec_id)
-            update_result(rec_id, 3, webvtt=vtt)
+            segments = transcribe_audio(audio)
+            update_result(rec_id, 3, webvtt=convert_to_vtt(segments))
             print(f"[INFO] Success: {rec_id}")
         except Exception as e:
-            traceback_str = traceback.format_exc(limit=5)
-            update_result(rec_id, -1, error=traceback_str)
+            update_result(rec_id, -1, error=format_error(e))
             print(f"[ERROR] Failed {rec_id}: {e}")
 
 if __name__ == "__main__":